@@ -1,5 +1,6 @@
 # config.py
 import os
+import subprocess
 import tempfile
 
 # --- 核心配置 ---
@@ -14,4 +15,41 @@ SOUNDFONT_PATH = os.path.join(WORK_DIR, "soundfont.sf2")
 
 # --- 临时文件路径 ---
 TEMP_DIR = os.path.join(tempfile.gettempdir(), "game_music_video_maker")
-os.makedirs(TEMP_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+# --- 视频编码器 ---
+def _probe_encoder(encoder):
+    """
+    实际编码一帧黑场验证编码器可用。完整版FFmpeg会把NVENC/QSV/AMF
+    都列在-encoders里，但没有对应硬件的机器上一初始化就会失败，
+    必须试跑一次才知道真的能用。
+    """
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'color=black:size=64x64:rate=1',
+             '-frames:v', '1', '-pix_fmt', 'yuv420p', '-c:v', encoder, '-f', 'null', '-'],
+            capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW, check=False
+        )
+    except OSError:
+        return False
+    return result.returncode == 0
+
+def detect_video_encoder():
+    """
+    探测FFmpeg可用的硬件H.264编码器，没有时回退CPU的libx264。
+    探测要跑真实的试编码，开销不小，所以只在主进程调用一次，
+    结果经进程池的initargs传给各worker。
+    """
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'], capture_output=True,
+            creationflags=subprocess.CREATE_NO_WINDOW, check=False
+        )
+    except OSError:
+        # ffmpeg缺失由主程序的依赖检查负责报错
+        return 'libx264'
+    available = result.stdout.decode('utf-8', 'ignore')
+    for encoder in ('h264_nvenc', 'h264_qsv', 'h264_amf', 'h264_videotoolbox'):
+        if encoder in available and _probe_encoder(encoder):
+            return encoder
+    return 'libx264'
\ No newline at end of file
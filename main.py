@@ -3,13 +3,22 @@ import sys
 import os
 import shutil
 import atexit
-from multiprocessing import Pool
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from PyQt6.QtWidgets import QApplication, QMessageBox
-from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtCore import QObject, QMetaObject, Qt, Q_ARG, QTimer, pyqtSignal, pyqtSlot
 
-from config import MAX_CONCURRENT_EXPORTS, MUSIC_DIR, MOVIE_DIR, SOUNDFONT_PATH, TEMP_DIR
-from workers import run_export_process
-from ui_components import MainWindow
+from config import MAX_CONCURRENT_EXPORTS, MUSIC_DIR, MOVIE_DIR, SOUNDFONT_PATH, TEMP_DIR, detect_video_encoder
+
+# FluidSynth运行库缺失时，pyfluidsynth在导入的瞬间就抛ImportError。
+# 这里兜住错误，推迟到依赖检查里用对话框提示，而不是裸着traceback崩掉
+try:
+    from workers import run_export_process, _worker_init, shutdown_render_executor
+    from ui_components import MainWindow
+    _IMPORT_ERROR = None
+except ImportError as e:
+    _IMPORT_ERROR = str(e)
 
 class ExportManager(QObject):
     _instance = None
@@ -30,88 +39,146 @@ class ExportManager(QObject):
             raise Exception("This class is a singleton!")
         else:
             super().__init__()
-            self.pool = Pool(processes=MAX_CONCURRENT_EXPORTS)
-            self.active_tasks = set()
+            # 编码器探测只在主进程做一次，结果随initargs传进每个worker
+            self.pool = ProcessPoolExecutor(
+                max_workers=MAX_CONCURRENT_EXPORTS,
+                initializer=_worker_init, initargs=(detect_video_encoder(),)
+            )
+            # 输出路径 -> 源音乐路径。导出完成时结果就是输出路径，可直接O(1)定位任务
+            self.active_tasks = {}
+            # 限制排队+执行中的任务总数，防止海量提交时pickle参数在内存里无限堆积
+            self._pending = threading.Semaphore(MAX_CONCURRENT_EXPORTS * 2)
             ExportManager._instance = self
 
     def submit_task(self, music_path, image_path):
-        if music_path in self.active_tasks:
-            return False
-
-        self.active_tasks.add(music_path)
         base_name, _ = os.path.splitext(os.path.basename(music_path))
         project_name = os.path.basename(os.path.dirname(music_path))
         output_path = os.path.join(MOVIE_DIR, project_name, f"{base_name}.mp4")
 
+        if output_path in self.active_tasks:
+            return False
+        if not self._pending.acquire(blocking=False):
+            self.status_update.emit("导出队列已满，请等待当前任务完成后再试。", 5000)
+            return False
+        self.active_tasks[output_path] = music_path
+
         self.status_update.emit(f"任务已添加: {base_name}.mp4", 3000)
         self.task_submitted.emit(music_path)
 
-        self.pool.apply_async(
-            run_export_process,
-            args=(music_path, image_path, output_path),
-            callback=self._on_task_completed,
-            error_callback=lambda e: self._on_task_failed(music_path, e)
-        )
+        self._submit_to_pool(music_path, image_path, output_path)
         return True
 
+    def _submit_to_pool(self, music_path, image_path, output_path):
+        future = self.pool.submit(run_export_process, music_path, image_path, output_path)
+        future.add_done_callback(lambda f, op=output_path: self._on_task_done(op, f))
+
+    def submit_batch(self, tasks):
+        """
+        批量提交导出任务。tasks为(music_path, image_path)元组列表。
+        去重、队列登记一次完成后统一入池。executor.map虽支持chunksize
+        但没有完成回调，逐个submit才能保留每个任务的UI进度通知。
+        返回实际入队的任务数。
+        """
+        batch = []
+        for music_path, image_path in tasks:
+            base_name, _ = os.path.splitext(os.path.basename(music_path))
+            project_name = os.path.basename(os.path.dirname(music_path))
+            output_path = os.path.join(MOVIE_DIR, project_name, f"{base_name}.mp4")
+            if output_path in self.active_tasks:
+                continue
+            if not self._pending.acquire(blocking=False):
+                self.status_update.emit("导出队列已满，剩余任务未加入。", 5000)
+                break
+            self.active_tasks[output_path] = music_path
+            self.task_submitted.emit(music_path)
+            batch.append((music_path, image_path, output_path))
+
+        if not batch:
+            return 0
+
+        for music_path, image_path, output_path in batch:
+            self._submit_to_pool(music_path, image_path, output_path)
+        self.status_update.emit(f"已批量添加 {len(batch)} 个任务", 3000)
+        return len(batch)
+
+    def _on_task_done(self, output_path, future):
+        """运行在executor的结果线程上，只负责按成功/失败分发。"""
+        error = future.exception()
+        if error is not None:
+            self._on_task_failed(output_path, error)
+        else:
+            self._on_task_completed(future.result())
+
     def _on_task_completed(self, result_path):
         """
-        任务移除修复: 重写此回调函数以正确地反向查找并移除任务。
+        运行在Pool内部的result-handler线程上，耗时操作会阻塞新任务的派发，
+        所以这里只做一件事：把收尾工作排队到Qt主线程。
         """
-        try:
-            # 1. 从结果路径分解出关键信息
-            output_filename = os.path.basename(result_path)
-            project_name = os.path.basename(os.path.dirname(result_path))
-            base_name, _ = os.path.splitext(output_filename)
-
-            # 2. 构造所有可能的原始音乐文件路径
-            possible_extensions = ['.mid', '.mp3', '.wav']
-            original_music_path = None
-            for ext in possible_extensions:
-                path_to_check = os.path.join(MUSIC_DIR, project_name, f"{base_name}{ext}")
-                # 3. 检查哪个路径存在于我们的活跃任务集合中
-                if path_to_check in self.active_tasks:
-                    original_music_path = path_to_check
-                    break
-            
-            # 4. 如果找到了匹配的路径，就移除它
-            if original_music_path:
-                self.active_tasks.remove(original_music_path)
-                self.status_update.emit(f"制作完成: {output_filename}", 5000)
-                self.task_finished.emit(result_path)
-            else:
-                # 这是一个异常情况，可能意味着任务状态不一致，但我们还是要通知UI
-                # 只是可能无法从队列中正确移除
-                print(f"警告: 无法在活跃任务中找到与 {result_path} 匹配的源文件。")
-                self.task_finished.emit(result_path)
-
-        except Exception as e:
-            print(f"在处理任务完成回调时发生错误: {e}")
-            # 即使回调出错，也尝试通知UI刷新
-            self.task_finished.emit(result_path)
-
-
-    def _on_task_failed(self, music_path, error):
-        if music_path in self.active_tasks:
-            self.active_tasks.remove(music_path)
-        
-        error_message = str(error)
+        QMetaObject.invokeMethod(
+            self, "_finalize_task", Qt.ConnectionType.QueuedConnection,
+            Q_ARG(str, result_path)
+        )
+
+    def _on_task_failed(self, output_path, error):
+        # 同样运行在result-handler线程上，只做排队
+        QMetaObject.invokeMethod(
+            self, "_finalize_failed_task", Qt.ConnectionType.QueuedConnection,
+            Q_ARG(str, output_path), Q_ARG(str, str(error))
+        )
+
+    @pyqtSlot(str)
+    def _finalize_task(self, result_path):
+        """在Qt主线程上移除任务并通知UI。结果路径即字典的键，一次查找完成。"""
+        if self.active_tasks.pop(result_path, None) is not None:
+            self._pending.release()
+        self.status_update.emit(f"制作完成: {os.path.basename(result_path)}", 5000)
+        self.task_finished.emit(result_path)
+
+    @pyqtSlot(str, str)
+    def _finalize_failed_task(self, output_path, error_message):
+        music_path = self.active_tasks.pop(output_path, None)
+        if music_path is not None:
+            self._pending.release()
+        music_path = music_path or output_path
         self.status_update.emit(f"制作失败: {os.path.basename(music_path)}", 5000)
         self.task_failed.emit(music_path, error_message)
 
     def shutdown(self):
         print("正在关闭进程池...")
-        self.pool.close()
-        self.pool.join()
+        self.pool.shutdown(wait=True)
         print("进程池已关闭。")
 
+def _gc_temp(max_age_s=24 * 3600, max_bytes=2 * 1024 ** 3):
+    """
+    回收TEMP_DIR中的陈旧缓存。atexit的清理在崩溃或进程被杀时不会执行，
+    渲染缓存会无限累积；这里按mtime从旧到新删除，直到目录总大小低于
+    max_bytes且剩余文件都在max_age_s时限内。
+    """
+    try:
+        with os.scandir(TEMP_DIR) as it:
+            entries = [(e.path, e.stat()) for e in it if e.is_file()]
+    except OSError:
+        return
+    entries.sort(key=lambda item: item[1].st_mtime)
+    total_bytes = sum(s.st_size for _, s in entries)
+    now = time.time()
+    for path, stat_result in entries:
+        if total_bytes <= max_bytes and now - stat_result.st_mtime <= max_age_s:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= stat_result.st_size
+        except OSError:
+            pass  # 文件可能正被某个worker使用，留给下一轮清理
+
 def check_dependencies():
     errors = []
+    if _IMPORT_ERROR: errors.append(f"依赖库加载失败（请确认已安装FluidSynth）:\n{_IMPORT_ERROR}")
     if not os.path.exists(MUSIC_DIR): os.makedirs(MUSIC_DIR); errors.append("'Music' 文件夹未找到，已自动创建。")
     if not os.path.exists(MOVIE_DIR): os.makedirs(MOVIE_DIR)
     if not os.path.exists(SOUNDFONT_PATH): errors.append("'soundfont.sf2' 未找到！")
     if not shutil.which("ffmpeg"): errors.append("'ffmpeg' 未找到，请安装并添加到系统PATH。")
-    if not shutil.which("fluidsynth"): errors.append("'fluidsynth' 未找到，请安装并添加到系统PATH。")
+    _gc_temp()
     return errors
 
 def cleanup_temp_files():
@@ -125,13 +192,21 @@ if __name__ == '__main__':
     except RuntimeError: pass
 
     app = QApplication(sys.argv)
-    
+
     dep_errors = check_dependencies()
     if dep_errors:
         QMessageBox.critical(None, "依赖缺失", "\n- ".join(dep_errors))
         sys.exit(1)
 
+    # 依赖检查通过后workers模块必定已导入，才能安全挂接退出钩子
+    app.aboutToQuit.connect(shutdown_render_executor)
     atexit.register(cleanup_temp_files)
+
+    # 会话期间每10分钟回收一次临时目录，防止长会话把磁盘写满
+    temp_gc_timer = QTimer()
+    temp_gc_timer.timeout.connect(_gc_temp)
+    temp_gc_timer.start(10 * 60 * 1000)
+
     export_manager = ExportManager.get_instance()
     atexit.register(export_manager.shutdown)
 
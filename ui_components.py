@@ -6,11 +6,11 @@ from PyQt6.QtWidgets import (
     QSplitter
 )
 from PyQt6.QtGui import QPixmap, QIcon, QGuiApplication
-from PyQt6.QtCore import Qt, QUrl, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QUrl, QThread, QThreadPool, QTimer, pyqtSignal
 from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
 
 from config import MUSIC_DIR, MOVIE_DIR, TEMP_DIR
-from workers import MidiRenderWorker, MidiPreRenderWorker
+from workers import MidiRenderRunnable, MidiPreRenderWorker, _cached_wav_path
 
 class ClickableSlider(QSlider):
     def __init__(self, *args, **kwargs):
@@ -30,9 +30,18 @@ class VideoMakerWindow(QWidget):
         self.export_manager = export_manager
         self.project_music_path = os.path.join(MUSIC_DIR, self.project_name)
         self.project_movie_path = os.path.join(MOVIE_DIR, self.project_name)
+        # 预先规范化的目录前缀：信号槽里用startswith判断归属，
+        # 既比子串in检查快，也不会误匹配路径中间恰好同名的片段
+        self._mus_prefix = os.path.normcase(os.path.abspath(self.project_music_path)) + os.sep
+        self._mov_prefix = os.path.normcase(os.path.abspath(self.project_movie_path)) + os.sep
         self.current_music_path = None; self.pixmap = None
         self.is_midi_rendering = False; self.total_duration = 0
         self.currently_playing_name = "未选择音乐"
+        self._music_list_state = None  # (音乐目录mtime, 视频目录mtime)缓存键
+        self._scaled_cache = (None, None)  # (目标尺寸, 缩放后的pixmap)
+        # 拖动窗口时resize事件连发，50ms单次定时器把它们合并成一次缩放
+        self._resize_timer = QTimer(self); self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(50); self._resize_timer.timeout.connect(self.update_image_display)
 
         self.init_ui()
         self.init_player()
@@ -54,9 +63,11 @@ class VideoMakerWindow(QWidget):
 
         files_to_render = []
         for midi_path in all_midis:
-            cached_wav_path = os.path.join(TEMP_DIR, f"{os.path.basename(midi_path)}.wav")
-            if not os.path.exists(cached_wav_path):
-                files_to_render.append(midi_path)
+            try:
+                if not os.path.exists(_cached_wav_path(midi_path)):
+                    files_to_render.append(midi_path)
+            except OSError:
+                continue  # 文件在列目录之后被删掉了，跳过即可
         
         if not files_to_render:
             self.statusUpdate.emit("所有MIDI文件已缓存，随时可以播放。", 3000)
@@ -98,8 +109,13 @@ class VideoMakerWindow(QWidget):
             self.player.play()
         
         elif self.current_music_path.lower().endswith('.mid'):
-            base_name = os.path.basename(self.current_music_path)
-            cached_wav_path = os.path.join(TEMP_DIR, f"{base_name}.wav")
+            try:
+                cached_wav_path = _cached_wav_path(self.current_music_path)
+            except OSError as e:
+                # 缓存键要stat源文件，列表里的文件可能已被删除；
+                # 槽函数里未捕获的异常会让整个应用中止，这里走既有的报错通道
+                self.on_midi_render_error(str(e))
+                return
 
             if os.path.exists(cached_wav_path):
                 source = QUrl.fromLocalFile(cached_wav_path)
@@ -109,37 +125,36 @@ class VideoMakerWindow(QWidget):
                 self.is_midi_rendering = True
                 self.statusUpdate.emit("正在实时渲染，请稍候...", 0)
                 self.play_pause_btn.setEnabled(False)
-                
-                self.render_thread = QThread()
-                self.render_worker = MidiRenderWorker(self.current_music_path)
-                self.render_worker.moveToThread(self.render_thread)
-                self.render_thread.started.connect(self.render_worker.run)
-                self.render_worker.finished.connect(self.on_midi_rendered)
-                self.render_worker.error.connect(self.on_midi_render_error)
-                self.render_thread.start()
+
+                # 全局线程池复用线程，点一次播放不再新建/销毁一个QThread
+                render_runnable = MidiRenderRunnable(self.current_music_path)
+                render_runnable.signals.finished.connect(self.on_midi_rendered)
+                render_runnable.signals.error.connect(self.on_midi_render_error)
+                QThreadPool.globalInstance().start(render_runnable)
                 
     # ... (其余所有方法保持原样) ...
+    def _is_in_project(self, path, prefix): return os.path.normcase(os.path.abspath(path)).startswith(prefix)
     def _on_task_submitted(self, music_path):
         task_name = os.path.basename(music_path)
-        if self.project_music_path in os.path.normpath(music_path): self.task_queue_widget.addItem(f"⏳ {task_name}")
+        if self._is_in_project(music_path, self._mus_prefix): self.task_queue_widget.addItem(f"⏳ {task_name}")
     def _on_task_finished(self, output_path):
-        if self.project_movie_path in os.path.normpath(output_path):
+        if self._is_in_project(output_path, self._mov_prefix):
             self.refresh_music_list(); self.refresh_task_queue()
     def _on_task_failed(self, music_file, error_message):
-        if self.project_music_path in os.path.normpath(music_file):
+        if self._is_in_project(music_file, self._mus_prefix):
             self.refresh_task_queue()
             QMessageBox.warning(self, "导出失败", f"制作视频 '{os.path.basename(music_file)}' 时出错:\n\n{error_message}")
     def refresh_task_queue(self):
         self.task_queue_widget.clear()
-        for task_path in self.export_manager.active_tasks:
-            if self.project_music_path in os.path.normpath(task_path):
+        for task_path in self.export_manager.active_tasks.values():
+            if self._is_in_project(task_path, self._mus_prefix):
                 self.task_queue_widget.addItem(f"⏳ {os.path.basename(task_path)}")
     def start_export(self):
         if self.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState: self.player.pause()
         if not self.current_music_path: QMessageBox.warning(self, "缺少信息", "请先在左侧选择一首音乐。"); return
         if not self.current_image_path: QMessageBox.warning(self, "缺少信息", "请先选择一张封面图片。"); return
         success = self.export_manager.submit_task(music_path=self.current_music_path, image_path=self.current_image_path)
-        if not success: QMessageBox.information(self, "任务已存在", "该音乐的导出任务已经在队列中或正在进行。")
+        if not success: QMessageBox.information(self, "任务未加入", "该音乐的导出任务已经在队列中，或导出队列已满。")
     def init_ui(self):
         self.setWindowTitle(f"项目: {self.project_name}"); self.setGeometry(200, 200, 1000, 600); self.setAcceptDrops(True)
         main_layout = QVBoxLayout(self)
@@ -181,14 +196,22 @@ class VideoMakerWindow(QWidget):
         self.player.positionChanged.connect(self.update_slider_and_time); self.player.durationChanged.connect(self.update_slider_range_and_time)
         self.player.playbackStateChanged.connect(self.update_button_state)
     def refresh_music_list(self):
-        self.music_list_widget.clear()
-        if not os.path.exists(self.project_music_path): return
+        if not os.path.exists(self.project_music_path): self.music_list_widget.clear(); return
         os.makedirs(self.project_movie_path, exist_ok=True)
-        music_files = [f for f in os.listdir(self.project_music_path) if f.lower().endswith(('.wav', '.mp3', '.mid'))]
-        for music_file in music_files:
-            base_name, _ = os.path.splitext(music_file)
-            video_file_path = os.path.join(self.project_movie_path, f"{base_name}.mp4")
-            if not os.path.exists(video_file_path): self.music_list_widget.addItem(music_file)
+        # 两个目录的mtime一起作为缓存键：目录内容没变就直接跳过重建
+        dir_state = (os.stat(self.project_music_path).st_mtime_ns, os.stat(self.project_movie_path).st_mtime_ns)
+        if dir_state == self._music_list_state: return
+        self._music_list_state = dir_state
+        self.music_list_widget.clear()
+        # 一次scandir取出已有视频的集合，免去对每个音乐文件单独exists()
+        with os.scandir(self.project_movie_path) as it:
+            existing_videos = {e.name for e in it if e.name.endswith('.mp4')}
+        with os.scandir(self.project_music_path) as it:
+            for entry in it:
+                if not entry.is_file(): continue
+                base_name, ext = os.path.splitext(entry.name)
+                if ext.lower() in ('.wav', '.mp3', '.mid') and f"{base_name}.mp4" not in existing_videos:
+                    self.music_list_widget.addItem(entry.name)
     def format_time(self, ms):
         if ms is None or ms < 0: return "00:00"
         s = int(ms / 1000); m, s = divmod(s, 60); return f"{m:02d}:{s:02d}"
@@ -198,11 +221,9 @@ class VideoMakerWindow(QWidget):
     def on_midi_rendered(self, wav_path):
         source = QUrl.fromLocalFile(wav_path); self.player.setSource(source); self.player.play()
         self.is_midi_rendering = False; self.play_pause_btn.setEnabled(True); self.statusUpdate.emit("", 1)
-        self.render_thread.quit(); self.render_thread.wait()
     def on_midi_render_error(self, error_msg):
         QMessageBox.critical(self, "MIDI渲染失败", f"无法渲染MIDI文件进行预览:\n{error_msg}")
         self.is_midi_rendering = False; self.play_pause_btn.setEnabled(True); self.statusUpdate.emit("", 1)
-        self.render_thread.quit(); self.render_thread.wait()
     def toggle_play_pause(self):
         if self.player.source().isEmpty() and self.current_music_path: self.play_music(); return
         if self.player.playbackState() == QMediaPlayer.PlaybackState.PlayingState: self.player.pause()
@@ -221,13 +242,17 @@ class VideoMakerWindow(QWidget):
     def set_image(self, image_path):
         self.current_image_path = image_path; self.pixmap = QPixmap(image_path)
         if self.pixmap.isNull(): self.remove_image(); return
-        self.update_image_display()
+        self._scaled_cache = (None, None); self.update_image_display()
     def update_image_display(self):
         if self.pixmap and not self.pixmap.isNull():
-            self.image_label.setPixmap(self.pixmap.scaled(self.image_label.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-    def resizeEvent(self, event): super().resizeEvent(event); self.update_image_display()
+            # SmoothTransformation缩放开销不小，目标尺寸没变就复用上次的结果
+            target_size = self.image_label.size()
+            if self._scaled_cache[0] == target_size: return
+            scaled = self.pixmap.scaled(target_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            self.image_label.setPixmap(scaled); self._scaled_cache = (target_size, scaled)
+    def resizeEvent(self, event): super().resizeEvent(event); self._resize_timer.start()
     def remove_image(self):
-        self.current_image_path = None; self.pixmap = None; self.image_label.clear()
+        self.current_image_path = None; self.pixmap = None; self._scaled_cache = (None, None); self.image_label.clear()
         self.image_label.setText("将图片拖到此处\n或点击下方按钮选择\n或按Ctrl+V粘贴")
     def select_image_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "选择一张图片", "", "图片文件 (*.png *.jpg *.jpeg *.bmp)")
@@ -252,11 +277,17 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self.central_widget); layout = QVBoxLayout(self.central_widget)
         layout.addWidget(QLabel("<h2>请选择一个项目:</h2>")); self.project_list = QListWidget()
         self.project_list.itemDoubleClicked.connect(self.open_project); layout.addWidget(self.project_list)
-        self.setStatusBar(QStatusBar()); self.load_projects(); self.video_maker_windows = {}
+        self.setStatusBar(QStatusBar()); self._projects_mtime = None; self.load_projects(); self.video_maker_windows = {}
     def load_projects(self):
+        if not os.path.exists(MUSIC_DIR): self.project_list.clear(); return
+        # Music目录mtime没变就沿用现有列表，避免重复扫描
+        dir_mtime = os.stat(MUSIC_DIR).st_mtime_ns
+        if dir_mtime == self._projects_mtime: return
+        self._projects_mtime = dir_mtime
         self.project_list.clear()
-        if not os.path.exists(MUSIC_DIR): return
-        projects = [d for d in os.listdir(MUSIC_DIR) if os.path.isdir(os.path.join(MUSIC_DIR, d))]
+        # scandir条目自带目录类型信息，省去对每个条目单独isdir()的stat
+        with os.scandir(MUSIC_DIR) as it:
+            projects = [e.name for e in it if e.is_dir(follow_symlinks=False)]
         if not projects:
             self.project_list.addItem("Music文件夹中没有找到项目文件夹"); self.project_list.setEnabled(False)
         else:
@@ -1,68 +1,156 @@
 # workers.py
 import os
-import shutil
 import uuid
+import hashlib
 import subprocess
-from PyQt6.QtCore import QObject, pyqtSignal
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import fluidsynth
+import soundfile
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
 from config import SOUNDFONT_PATH, TEMP_DIR
 
-def _render_midi_to_wav_internal(input_midi_path, output_wav_path):
+RENDER_SAMPLE_RATE = 44100
+_RENDER_CHUNK_FRAMES = 4096
+
+# 本进程使用的视频编码器。探测只在主进程做一次，worker进程由_worker_init
+# 通过initargs拿到结果，避免每个spawn出的进程都重新试编码一遍
+_VIDEO_ENCODER = 'libx264'
+
+def _video_encoder_args():
+    """按当前编码器拼装FFmpeg视频参数：libx264用preset/tune，NVENC用p1~p7，
+    其余硬件编码器用默认参数即可（静止画面对它们都是小菜一碟）。"""
+    if _VIDEO_ENCODER == 'h264_nvenc':
+        return ['-c:v', 'h264_nvenc', '-preset', 'p1']
+    if _VIDEO_ENCODER == 'libx264':
+        return ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'stillimage']
+    return ['-c:v', _VIDEO_ENCODER]
+
+# 每个线程持有独立的Synth实例：libfluidsynth的渲染调用不是线程安全的，
+# 而SoundFont只需在线程首次渲染时解析一次，之后所有渲染直接复用。
+_thread_local = threading.local()
+
+def _get_synth():
+    """返回当前线程专属的、已加载SoundFont的Synth实例（首次调用时创建）。"""
+    synth = getattr(_thread_local, "synth", None)
+    if synth is None:
+        synth = fluidsynth.Synth(samplerate=RENDER_SAMPLE_RATE)
+        if synth.sfload(SOUNDFONT_PATH) == -1:
+            raise RuntimeError(f"无法加载SoundFont: {SOUNDFONT_PATH}")
+        _thread_local.synth = synth
+    return synth
+
+def _cached_wav_path(midi_path):
     """
-    内部核心函数：将一个MIDI文件渲染成WAV。
-    使用安全的临时文件副本策略来处理特殊字符路径。
+    返回一个MIDI文件对应的缓存WAV路径。
+    缓存键由绝对路径+文件大小+修改时间构成，源文件一变缓存即失效；
+    预览、预渲染和导出共用同一份缓存，渲染过一次就不再渲染。
+    """
+    p = os.path.abspath(midi_path)
+    s = os.stat(p)
+    digest = hashlib.blake2b(
+        f"{p}|{s.st_size}|{s.st_mtime_ns}".encode(), digest_size=12
+    ).hexdigest()
+    return os.path.join(TEMP_DIR, digest + ".wav")
+
+def _worker_init(video_encoder):
     """
-    safe_input_midi_path = None
-    safe_output_wav_path = None
+    进程池worker的初始化函数：接过主进程探测好的视频编码器，并在worker
+    进程启动时就加载好SoundFont，这样每个导出任务只需毫秒级的合成开销，
+    而不是每次都重新解析sf2。
+    """
+    global _VIDEO_ENCODER
+    _VIDEO_ENCODER = video_encoder
+    _get_synth()
+
+def _render_midi_samples(midi_path):
+    """进程内渲染：把一个MIDI文件合成为交错立体声int16采样数组。"""
+    synth = _get_synth()
+    # Synth跨渲染复用，先复位：清掉上一个文件留下的音色、控制器、弯音和尚未
+    # 衰减完的声音，保证每次渲染都和独立进程一样从干净状态开始
+    synth.system_reset()
+    # pyfluidsynth没有高层Player类，直接用它暴露的ctypes绑定驱动fluid_player
+    player = fluidsynth.new_fluid_player(synth.synth)
     try:
-        # 1. 为输入MIDI创建安全的临时副本
-        safe_input_midi_path = os.path.join(TEMP_DIR, f"render_in_{uuid.uuid4()}.mid")
-        shutil.copy(input_midi_path, safe_input_midi_path)
-        
-        # 2. 为输出WAV创建安全的临时路径
-        safe_output_wav_path = os.path.join(TEMP_DIR, f"render_out_{uuid.uuid4()}.wav")
-
-        command = [
-            'fluidsynth', '-ni', SOUNDFONT_PATH, safe_input_midi_path,
-            '-F', safe_output_wav_path, '-r', '44100'
-        ]
-        
-        result = subprocess.run(
-            command, capture_output=True,
-            creationflags=subprocess.CREATE_NO_WINDOW, check=False
-        )
-
-        if result.returncode != 0 or not os.path.exists(safe_output_wav_path):
-            error_message = result.stderr.decode('utf-8', 'ignore')
-            raise RuntimeError(f"FluidSynth渲染失败，无法创建输出文件。\n错误信息: {error_message}")
-        
-        # 3. 将安全的临时输出文件重命名为最终的缓存文件名
-        if os.path.exists(output_wav_path):
-            os.remove(output_wav_path)
-        os.rename(safe_output_wav_path, output_wav_path)
+        if fluidsynth.fluid_player_add(player, midi_path.encode()) < 0:
+            raise RuntimeError(f"FluidSynth无法读取MIDI文件: {midi_path}")
+        if fluidsynth.fluid_player_play(player) < 0:
+            raise RuntimeError(f"FluidSynth无法开始播放MIDI文件: {midi_path}")
+        chunks = []
+        while fluidsynth.fluid_player_get_status(player) != fluidsynth.FLUID_PLAYER_DONE:
+            chunks.append(synth.get_samples(_RENDER_CHUNK_FRAMES))
+    finally:
+        fluidsynth.delete_fluid_player(player)
+    if not chunks:
+        raise RuntimeError(f"MIDI文件没有产生任何音频: {midi_path}")
+    return np.concatenate(chunks).reshape(-1, 2)
 
+def _write_wav_atomic(samples, output_wav_path):
+    """先写入临时文件再原子替换，避免其他线程读到写了一半的缓存文件。"""
+    safe_output_wav_path = os.path.join(TEMP_DIR, f"render_out_{uuid.uuid4()}.wav")
+    try:
+        soundfile.write(safe_output_wav_path, samples, RENDER_SAMPLE_RATE, subtype='PCM_16')
+        # os.replace在POSIX和Windows上都是原子覆盖，没有先删再改名的竞态窗口
+        os.replace(safe_output_wav_path, output_wav_path)
     finally:
-        # 4. 清理所有临时文件
-        if safe_input_midi_path and os.path.exists(safe_input_midi_path):
-            os.remove(safe_input_midi_path)
-        if safe_output_wav_path and os.path.exists(safe_output_wav_path):
+        if os.path.exists(safe_output_wav_path):
             os.remove(safe_output_wav_path)
 
-class MidiRenderWorker(QObject):
-    """用于【单个文件】点击播放时的实时渲染。"""
+def _render_midi_to_wav_internal(input_midi_path, output_wav_path):
+    """
+    内部核心函数：将一个MIDI文件渲染成WAV。
+    渲染在本进程内完成，libfluidsynth原生支持Unicode路径，无需临时副本。
+    """
+    _write_wav_atomic(_render_midi_samples(input_midi_path), output_wav_path)
+
+# GUI进程内所有MIDI渲染共用的常驻线程池。线程长期存活，各自线程本地的Synth
+# （连同一份SoundFont）只创建这么多个并一直复用——临时线程销毁时C侧的Synth
+# 不会被释放，等于直接泄漏一份SoundFont。每个线程都要常驻一份SoundFont，
+# 所以并行度刻意压得很低。
+_RENDER_THREADS = 2
+_render_executor = ThreadPoolExecutor(max_workers=_RENDER_THREADS, thread_name_prefix='midi_render')
+# 预览专用的单线程通道：点播放的渲染不能排在几十个预渲染任务后面等
+_preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='midi_preview')
+
+def _render_to_cache(midi_path):
+    """确保midi_path对应的缓存WAV存在，返回缓存路径。"""
+    final_cached_wav_path = _cached_wav_path(midi_path)
+    if not os.path.exists(final_cached_wav_path):
+        _render_midi_to_wav_internal(midi_path, final_cached_wav_path)
+    return final_cached_wav_path
+
+def shutdown_render_executor():
+    """
+    退出时立即丢弃排队中的渲染任务。不主动取消的话，executor自带的
+    退出钩子会等队列里所有任务跑完才放线程走——预渲染积压时关窗后
+    进程会无窗口地卡上几分钟。
+    """
+    _render_executor.shutdown(wait=False, cancel_futures=True)
+    _preview_executor.shutdown(wait=False, cancel_futures=True)
+
+class MidiRenderSignals(QObject):
+    """QRunnable本身不能带信号，挂一个QObject作为信号载体。"""
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
 
+class MidiRenderRunnable(QRunnable):
+    """用于【单个文件】点击播放时的实时渲染，交给全局QThreadPool复用线程执行。"""
+
     def __init__(self, midi_path):
         super().__init__()
         self.midi_path = midi_path
+        self.signals = MidiRenderSignals()
 
     def run(self):
         try:
-            final_cached_wav_path = os.path.join(TEMP_DIR, f"{os.path.basename(self.midi_path)}.wav")
-            _render_midi_to_wav_internal(self.midi_path, final_cached_wav_path)
-            self.finished.emit(final_cached_wav_path)
+            # 渲染转交常驻的预览专用线程：QThreadPool的空闲线程半分钟就会
+            # 销毁，在那些线程上创建线程本地Synth会随线程一起泄漏；
+            # 独立通道也保证预览不用排在预渲染积压后面
+            future = _preview_executor.submit(_render_to_cache, self.midi_path)
+            self.signals.finished.emit(future.result())
         except Exception as e:
-            self.error.emit(str(e))
+            self.signals.error.emit(str(e))
 
 class MidiPreRenderWorker(QObject):
     """用于【项目打开时】批量预渲染所有未缓存的MIDI文件。"""
@@ -75,52 +163,130 @@ class MidiPreRenderWorker(QObject):
 
     def run(self):
         total = len(self.midi_files)
-        for i, midi_path in enumerate(self.midi_files):
+        # 渲染跑在常驻渲染线程池上，libfluidsynth合成时不占GIL，可以真正并行；
+        # 完成顺序不再与提交顺序一致，但进度计数仍然正确
+        futures = {_render_executor.submit(_render_to_cache, p): p for p in self.midi_files}
+        for i, future in enumerate(as_completed(futures)):
+            midi_path = futures[future]
+            self.progress_update.emit(os.path.basename(midi_path), i + 1, total)
             try:
-                base_name = os.path.basename(midi_path)
-                self.progress_update.emit(base_name, i + 1, total)
-                final_cached_wav_path = os.path.join(TEMP_DIR, f"{base_name}.wav")
-                _render_midi_to_wav_internal(midi_path, final_cached_wav_path)
+                future.result()
             except Exception as e:
                 # 预渲染失败不应中断整个流程，只在控制台打印错误
                 print(f"预渲染文件失败 '{midi_path}': {e}")
         self.finished.emit()
 
 
+_STDERR_TAIL_BYTES = 64 * 1024
+
+def _drain_stderr_tail(stream, holder):
+    """
+    在独立线程中持续排空子进程的stderr，只保留末尾64KB——
+    足够容纳失败时的错误信息，又不会让FFmpeg长任务的海量进度输出
+    随任务时长无限占用内存。
+    """
+    tail = b''
+    while True:
+        chunk = stream.read(_STDERR_TAIL_BYTES)
+        if not chunk:
+            break
+        tail = (tail + chunk)[-_STDERR_TAIL_BYTES:]
+    holder.append(tail)
+
+
+def _run_ffmpeg(command, stdin_data=None):
+    """运行一条FFmpeg命令，失败时带着stderr末尾抛出RuntimeError。"""
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        creationflags=subprocess.CREATE_NO_WINDOW
+    )
+    stderr_tail = []
+    drain_thread = threading.Thread(
+        target=_drain_stderr_tail, args=(process.stderr, stderr_tail), daemon=True
+    )
+    drain_thread.start()
+    if stdin_data is not None:
+        try:
+            process.stdin.write(stdin_data)
+            process.stdin.close()
+        except OSError:
+            # FFmpeg出错提前退出时，write和close（冲刷缓冲）都可能因断开的
+            # 管道抛错；真正的失败由returncode和stderr尾部上报
+            pass
+    process.wait()
+    drain_thread.join()
+
+    if process.returncode != 0:
+        error_message = (stderr_tail[0] if stderr_tail else b'').decode('utf-8', 'ignore')
+        raise RuntimeError(f"FFmpeg合成失败: {error_message}")
+
+
+def _cached_cover_path(image_path):
+    """封面图片对应的预编码单帧视频缓存路径，键同样是路径+大小+mtime。"""
+    p = os.path.abspath(image_path)
+    s = os.stat(p)
+    digest = hashlib.blake2b(
+        f"{p}|{s.st_size}|{s.st_mtime_ns}".encode(), digest_size=12
+    ).hexdigest()
+    return os.path.join(TEMP_DIR, digest + ".mp4")
+
+
+# 封面单帧的时长：stream copy循环时整个IDR包每这么多秒重复一次。
+# 取10秒可把复制的视频体积压到1fps方案的1/10（4分钟曲目只循环24个包），
+# 又不至于长到让播放器的进度条/缩略图行为出问题
+_COVER_FRAME_SECONDS = 10
+
+def _ensure_cover_video(image_path):
+    """
+    把封面图片预编码成只含一个IDR帧的H.264视频，每张图片只编码一次；
+    之后的每次导出对视频流做stream copy，完全不再跑视频编码器。
+    """
+    cover_path = _cached_cover_path(image_path)
+    if os.path.exists(cover_path):
+        return cover_path
+
+    safe_cover_path = os.path.join(TEMP_DIR, f"cover_{uuid.uuid4()}.mp4")
+    try:
+        _run_ffmpeg([
+            'ffmpeg', '-y', '-framerate', f'1/{_COVER_FRAME_SECONDS}', '-loop', '1',
+            '-t', str(_COVER_FRAME_SECONDS), '-i', image_path,
+            *_video_encoder_args(), '-pix_fmt', 'yuv420p', '-g', '1',
+            safe_cover_path
+        ])
+        os.replace(safe_cover_path, cover_path)
+    finally:
+        if os.path.exists(safe_cover_path):
+            os.remove(safe_cover_path)
+    return cover_path
+
+
 def run_export_process(music_path, image_path, output_path):
     """用于视频导出的进程池函数。"""
-    safe_input_midi_path = None
-    temp_wav_path = None
-    try:
-        is_midi = music_path.lower().endswith('.mid')
-        
-        if is_midi:
-            safe_input_midi_path = os.path.join(TEMP_DIR, f"export_in_{uuid.uuid4()}.mid")
-            shutil.copy(music_path, safe_input_midi_path)
-            temp_wav_path = os.path.join(os.path.dirname(output_path), f"_temp_export_{uuid.uuid4()}.wav")
-            
-            _render_midi_to_wav_internal(safe_input_midi_path, temp_wav_path)
-            audio_input_path = temp_wav_path
+    stdin_data = None
+
+    if music_path.lower().endswith('.mid'):
+        # 与预览共用缓存：同一个MIDI只渲染一次
+        cached_wav_path = _cached_wav_path(music_path)
+        if os.path.exists(cached_wav_path):
+            audio_args = ['-i', cached_wav_path]
         else:
-            audio_input_path = music_path
-
-        command = [
-            'ffmpeg', '-y', '-loop', '1', '-i', image_path,
-            '-i', audio_input_path, '-c:v', 'libx264', '-tune', 'stillimage',
-            '-c:a', 'aac', '-b:a', '192k', '-pix_fmt', 'yuv420p', '-shortest',
-            output_path
-        ]
-        result = subprocess.run(
-            command, capture_output=True,
-            creationflags=subprocess.CREATE_NO_WINDOW, check=False
-        )
-        if result.returncode != 0:
-            error_message = result.stderr.decode('utf-8', 'ignore')
-            raise RuntimeError(f"FFmpeg合成失败: {error_message}")
-
-        return output_path
-    finally:
-        if safe_input_midi_path and os.path.exists(safe_input_midi_path):
-            os.remove(safe_input_midi_path)
-        if temp_wav_path and os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
\ No newline at end of file
+            # 缓存未命中：在内存中渲染一次，写入缓存供预览复用，同时把采样
+            # 直接通过管道喂给FFmpeg，省去刚写完WAV又立刻回读的磁盘往返
+            samples = _render_midi_samples(music_path)
+            _write_wav_atomic(samples, cached_wav_path)
+            audio_args = ['-f', 's16le', '-ar', str(RENDER_SAMPLE_RATE), '-ac', '2', '-i', 'pipe:0']
+            stdin_data = samples.tobytes()
+    else:
+        audio_args = ['-i', music_path]
+
+    # 视频流直接stream copy预编码的单帧封面：每次导出只剩封装和音频编码
+    cover_path = _ensure_cover_video(image_path)
+    _run_ffmpeg([
+        'ffmpeg', '-y', '-stream_loop', '-1', '-i', cover_path,
+        *audio_args, '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k', '-shortest',
+        output_path
+    ], stdin_data)
+
+    return output_path
\ No newline at end of file